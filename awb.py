@@ -1,10 +1,57 @@
 import struct
 import os
+import sys
 import json
-import re
+import mmap
+import copy
+import functools
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO, FileIO
 from collections.abc import Buffer
 
+## 文件头部结构，依次为文件头部标识、版本号、偏移量表条目大小、ID表条目大小、包含文件数量、数据对齐偏移量、subkey
+_AWB_HEADER = struct.Struct("<4sBBHIHH")
+
+## 文件头读取所得的各项数据，用于文件头数据缓存
+_AWB_HEADER_FIELDS = ("headerID", "version", "offset_size", "audioid_size", "subfiles_count", 
+                      "offset_alignment", "subkey", "audioids", "audio_offsets", "audio_starts")
+
+## ID表及偏移量表中条目大小与其类型码(struct及array通用)的对应关系
+_AWB_TYPECODES = {0x02: "H", 0x04: "I"}
+
+## 子文件头部标识与文件类型的对应关系，以及各文件类型的后缀名
+_SUBFILE_TYPES = {b"HCA\x00": "HCA", b"\xC8\xC3\xC1\x00": "EHCA"}
+_SUBFILE_SUFFIXES = {"HCA": "hca", "EHCA": "hca"}
+
+## 不使用os.sendfile时，每次写入的最大数据量
+_COPY_CHUNK_SIZE = 1 << 20
+
+## 子文件平均大小达到此值时，默认以线程池并行写入子文件
+_PARALLEL_COPY_MIN_SIZE = 1 << 20
+
+## 仅在Linux下使用os.sendfile在内核中直接复制文件数据(与shutil的判断方式一致)
+_USE_SENDFILE = hasattr(os, "sendfile") and sys.platform.startswith("linux")
+
+
+## 使用os.sendfile将输入文件中指定范围的数据写入输出文件的当前位置
+def _sendfileCopy(out_fd: int, in_fd: int, offset: int, count: int) -> None:
+    while count > 0:
+        sent = os.sendfile(out_fd, in_fd, offset, count)
+        if sent == 0:
+            raise EOFError(f"unexpected end of file at offset {offset:#x}")
+        offset += sent
+        count -= sent
+
+## 以固定大小的块将输入文件当前位置起count字节的数据写入输出文件的当前位置
+def _chunkedCopy(out_file, in_file, count: int) -> None:
+    while count > 0:
+        data = in_file.read(min(count, _COPY_CHUNK_SIZE))
+        if not data:
+            raise EOFError(f"unexpected end of file, {count:#x} bytes missing")
+        out_file.write(data)
+        count -= len(data)
+
 
 class AWB:
     ## awb是CRI的一种音频存储格式，用于存储音频数据本身
@@ -12,14 +59,35 @@ class AWB:
     ## 文件头部大小为0x10字节，其后依次为ID表和偏移量表，再之后为子文件
     ## 子文件根据『数据对齐偏移量』进行对齐
 
-    def __init__(self, stream: str | Buffer) -> None:
-        if type(stream) == str:
+    ## header_cache为是否使用文件头数据缓存，仅在输入为文件路径时有效
+    ## 缓存以(文件路径, 修改时间, 文件大小)为键，同一文件被反复打开时可省去文件头读取
+    def __init__(self, stream: str | Buffer, header_cache: bool=False) -> None:
+        if isinstance(stream, str):
             self.stream = FileIO(stream)
-            self.filename = re.split(r"[/\\]", stream)[-1]
+            self.filename = os.path.basename(stream.replace("\\", "/"))
+            ## 以只读方式映射整个文件，解析时直接从映射的内存中读取
+            self._buf = mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
         else:
             self.stream = BytesIO(stream)
             self.filename = ""
-        self.headerRead()
+            self._buf = self.stream.getbuffer()
+
+        if header_cache and isinstance(stream, str):
+            stat = os.stat(stream)
+            header_fields = _awbHeaderCached(os.path.abspath(stream), stat.st_mtime_ns, stat.st_size)
+            ## 表格数据可能会被修改，因此取其副本
+            for name, value in zip(_AWB_HEADER_FIELDS, header_fields):
+                setattr(self, name, copy.copy(value))
+        else:
+            self.headerRead()
+
+    ## 关闭文件及其内存映射
+    def close(self) -> None:
+        if isinstance(self._buf, memoryview):
+            self._buf.release()
+        else:
+            self._buf.close()
+        self.stream.close()
 
     def headerRead(self) -> None:
         ## 文件头读取，含文件头部标识(4字节)、版本号(1字节)、偏移量表中每个条目的字节大小(1字节)、
@@ -27,62 +95,40 @@ class AWB:
         ## 其后为ID表和偏移量表，偏移量表的数据数量比包含文件数量多1个，似乎用于指示最后一个子文件的结束位置(通常为文件末尾)
         ## vgmstream的注释中指出，表中的偏移量可能会错位，特别是首个偏移量可能会指向偏移量表末尾，此时需要配合数据对齐偏移量来计算首个子文件的起始位置的偏移量
         ## 经过观察，偏移量表中的偏移量可能指向上一个子文件的末尾，此时也需要配合数据对齐偏移量来计算下一个子文件的起始位置
-        stream = self.stream
         offset = 0x00
-        stream.seek(0)
-        self.headerID = stream.read(4)
+        if len(self._buf) < _AWB_HEADER.size:
+            raise ValueError("invalid awb header")
+        (self.headerID, self.version, self.offset_size, self.audioid_size,
+         self.subfiles_count, self.offset_alignment, self.subkey) = _AWB_HEADER.unpack_from(self._buf, 0)
 
         if self.headerID == b"AFS2":
             #self.encrypted = False
             pass
         else:
             raise ValueError("invalid awb header")
-        
-        self.version            = struct.unpack("<B", stream.read(1))[0]
-        self.offset_size        = struct.unpack("<B", stream.read(1))[0]
-        self.audioid_size       = struct.unpack("<H", stream.read(2))[0]
-        self.subfiles_count     = struct.unpack("<I", stream.read(4))[0]
-        self.offset_alignment   = struct.unpack("<H", stream.read(2))[0]
-        self.subkey             = struct.unpack("<H", stream.read(2))[0]
+
         offset += 0x10
 
-        ## 读取ID表
-        self.audioids = []
-        if self.audioid_size == 0x02:
-            for _ in range(0, self.subfiles_count):
-                audioid = struct.unpack("<H", stream.read(2))[0]
-                offset += 2
-                self.audioids.append(audioid)
-        elif self.audioid_size == 0x04:
-            for _ in range(0, self.subfiles_count):
-                audioid = struct.unpack("<I", stream.read(4))[0]
-                offset += 4
-                self.audioids.append(audioid)
-        else:
+        ## 读取ID表，整张表直接载入数组(array)中，不会为每个条目单独创建int对象
+        audioid_type_fc = _AWB_TYPECODES.get(self.audioid_size)
+        if audioid_type_fc is None:
             raise ValueError(f"unknown awb audio ID size: {self.audioid_size:02x}")
+        self.audioids = self.tableRead(audioid_type_fc, offset, self.subfiles_count)
+        offset += self.audioid_size * self.subfiles_count
         
-        ## 读取偏移量表
-        self.audio_offsets = []
-        if self.offset_size == 0x02:
-            for _ in range(0, self.subfiles_count + 1):
-                audioid = struct.unpack("<H", stream.read(2))[0]
-                offset += 2
-                self.audio_offsets.append(audioid)
-        elif self.offset_size == 0x04:
-            for _ in range(0, self.subfiles_count + 1):
-                audioid = struct.unpack("<I", stream.read(4))[0]
-                offset += 4
-                self.audio_offsets.append(audioid)
-        else:
+        ## 读取偏移量表，同上
+        offset_type_fc = _AWB_TYPECODES.get(self.offset_size)
+        if offset_type_fc is None:
             raise ValueError(f"unknown awb offset size: {self.offset_size:02x}")
+        self.audio_offsets = self.tableRead(offset_type_fc, offset, self.subfiles_count + 1)
+        offset += self.offset_size * (self.subfiles_count + 1)
         
         ## 此时的偏移量应小于或等于偏移量表首项
         if offset > self.audio_offsets[0]:
             raise ValueError("offset now should not be greater than audio_offsets[0]")
         
         ## 文件总大小应大于或等于偏移量表末项
-        stream.seek(0, 2)
-        if stream.tell() < self.audio_offsets[-1]:
+        if len(self._buf) < self.audio_offsets[-1]:
             raise ValueError("awb file size should not be less than audio_offsets[-1]")
         
         ## 若偏移量表首项仅指向偏移量表末尾，则需要配合数据对齐偏移量来计算首个子文件的起始位置的偏移量
@@ -91,49 +137,60 @@ class AWB:
         if remainder > 0:
             self.audio_offsets[0] = self.audio_offsets[0] - remainder + self.offset_alignment
 
+        ## 偏移量表中的数值可能为上一块数据的末尾，此处一次性计算各子文件的『数据起始偏移量』
+        ## 即大于等于『偏移量表数值』的最小的『数据对齐偏移量』整数倍
+        alignment = self.offset_alignment
+        self.audio_starts = [(audio_offset + alignment - 1) // alignment * alignment for audio_offset in self.audio_offsets[:-1]]
+
+    ## 从指定偏移量处读取由count个小端序无符号整数组成的表，返回数组(array)
+    def tableRead(self, type_fc: str, offset: int, count: int) -> array:
+        table = array(type_fc)
+        table_size = table.itemsize * count
+        if offset + table_size > len(self._buf):
+            raise ValueError(f"awb table out of bounds: {offset + table_size:#x}")
+        table.frombytes(self._buf[offset:offset + table_size])
+        if sys.byteorder == "big":
+            table.byteswap()
+        return table
+
     def extract(self, opt_dir, acb_data : dict | None = None) -> None:
         ## 从awb中解包音频，并输出至指定目录
         ## 音频文件名通过解析相应的acb文件获得，若无acb数据，则默认以『awb文件名_音频ID』作为文件名
         ## awb可打包不同类型的音频文件，文件的后缀名将由其类型决定，目前已处理的音频类型有：hca
-        stream = self.stream
-        for idx in range(0, self.subfiles_count):
-            ## 检查偏移量表中的数值是否对齐（此数值可能为上一块数据的末尾），若否，则计算正确的起始位置
-            ## 此处将计算大于等于『偏移量表数值』的最小的『数据对齐偏移量』整数倍，并将其作为『数据起始偏移量』
-            remainder = self.audio_offsets[idx] % self.offset_alignment
-            if remainder > 0:
-                offset_start = self.audio_offsets[idx] - remainder + self.offset_alignment
-            else:
-                ## remainder == 0
-                offset_start = self.audio_offsets[idx] 
-
-            stream.seek(offset_start)
-            sf_type = self.getFileType(stream.read(16))
-            sf_name_suffix = self.fileSuffixSet(sf_type)
-            if acb_data is None:
-                sf_name = f"{self.filename}_{self.audioids[idx]:08x}.{sf_name_suffix}"
-            else:
-                #sf_name = f""
-                pass
-            stream.seek(offset_start)
-            data = stream.read(self.audio_offsets[idx+1] - offset_start)
-            with open(os.path.join(opt_dir, sf_name), "wb") as file:
-                file.write(data)
-
-    ## 根据文件头部判断文件类型
-    def getFileType(self, header: bytes) -> str | None:
-        if header.startswith(b"HCA\x00"):
-            return "HCA"
-        elif header.startswith(b"\xC8\xC3\xC1\x00"):
-            return "EHCA"
-        else:
-            return None
+        ## 子文件数据直接以切片的形式从映射的内存中取得，不经过额外的读取和复制
+        ## 若输入为文件且系统支持，则使用os.sendfile在内核中直接复制数据
+        ## 使用os.sendfile时数据不经过Python的写缓冲区，因此以无缓冲模式打开输出文件，省去每个文件的缓冲区分配
+        use_sendfile = _USE_SENDFILE and isinstance(self.stream, FileIO)
+        opt_buffering = 0 if use_sendfile else -1
+        audio_starts = self.audio_starts
+        audio_offsets = self.audio_offsets
+        with memoryview(self._buf) as buf_view:
+            for idx in range(0, self.subfiles_count):
+                ## 『数据起始偏移量』已在文件头读取时计算
+                offset_start = audio_starts[idx]
+                data = buf_view[offset_start:audio_offsets[idx+1]]
+                sf_type = self.getFileType(data[:4])
+                sf_name_suffix = self.fileSuffixSet(sf_type)
+                if acb_data is None:
+                    sf_name = f"{self.filename}_{self.audioids[idx]:08x}.{sf_name_suffix}"
+                else:
+                    #sf_name = f""
+                    pass
+                with open(os.path.join(opt_dir, sf_name), "wb", buffering=opt_buffering) as file:
+                    if use_sendfile:
+                        _sendfileCopy(file.fileno(), self.stream.fileno(), offset_start, len(data))
+                    else:
+                        ## 以固定大小的块分段写入，每次写入仅涉及映射内存中的一小段
+                        for pos in range(0, len(data), _COPY_CHUNK_SIZE):
+                            file.write(data[pos:pos + _COPY_CHUNK_SIZE])
+
+    ## 根据文件头部判断文件类型，以头部4字节查表
+    def getFileType(self, header: Buffer) -> str | None:
+        return _SUBFILE_TYPES.get(bytes(header[:4]))
         
     ## 根据文件类型设置文件后缀名
     def fileSuffixSet(self, sf_type: str | None) -> str:
-        if sf_type in ("HCA", "EHCA"):
-            return "hca"
-        else:
-            return "bin"
+        return _SUBFILE_SUFFIXES.get(sf_type, "bin")
 
     ## 输出文件头数据，调试用
     def headerDataOutput(self, opt_path: str) -> None:
@@ -141,13 +198,22 @@ class AWB:
         header_data = {"headerID":headerID, "version":self.version, "offset_size":self.offset_size, 
                        "audioid_size":self.audioid_size, "subfiles_count":self.subfiles_count, 
                        "offset_alignment":self.offset_alignment, "subkey":self.subkey, 
-                       "audio_ids":self.audioids, "audio_offsets":self.audio_offsets
+                       "audio_ids":self.audioids.tolist(), "audio_offsets":self.audio_offsets.tolist()
                        }
         
         with open(opt_path, "w", encoding="utf8") as file:
             json.dump(header_data, file, ensure_ascii=False, indent=4)
 
 
+## 读取awb文件的文件头数据，并以(文件路径, 修改时间, 文件大小)为键缓存
+@functools.lru_cache(maxsize=256)
+def _awbHeaderCached(path: str, mtime_ns: int, size: int) -> tuple:
+    awb = AWB(path)
+    header_fields = tuple(getattr(awb, name) for name in _AWB_HEADER_FIELDS)
+    awb.close()
+    return header_fields
+
+
 class AWBBuilder:
     ## 输入文件列表，将其中的文件打包为awb文件
     ## 不会检测文件类型，请自行确保其正确性
@@ -217,8 +283,31 @@ class AWBBuilder:
             offset_start = offset
         return offset_start
 
+    ## 将子文件的数据写入输出文件的当前位置，并返回子文件大小
+    ## 子文件大小由调用方给出(即计算子文件位置时所用的大小)，仅复制该大小的数据，
+    ## 以免子文件大小在此期间发生变化时覆盖相邻子文件的区域；子文件变短时抛出EOFError
+    ## 若系统支持，则使用os.sendfile在内核中直接复制数据，否则以固定大小的块进行复制
+    def subfileWrite(self, file, subfile: str, sf_size: int) -> int:
+        with open(subfile, "rb") as sf:
+            if _USE_SENDFILE:
+                ## 先写出缓冲区中的数据，以保证输出文件的当前位置正确
+                file.flush()
+                _sendfileCopy(file.fileno(), sf.fileno(), 0, sf_size)
+            else:
+                _chunkedCopy(file, sf, sf_size)
+        return sf_size
+
+    ## 以独立的文件句柄打开输出文件，将子文件写入其预先计算好的位置
+    ## 各子文件所写入的区域互不重叠，因此可以并行执行
+    def subfileCopy(self, opt_path: str, subfile: str, offset_start: int, sf_size: int) -> None:
+        with open(opt_path, "r+b") as file:
+            file.seek(offset_start)
+            self.subfileWrite(file, subfile, sf_size)
 
-    def build(self, opt_path: str) -> None:
+    ## max_workers为并行写入子文件时所用的最大线程数
+    ## 默认以单个文件句柄依次写入各子文件；指定max_workers，或子文件平均大小达到_PARALLEL_COPY_MIN_SIZE时，以线程池并行写入
+    ## (子文件较小时，为每个子文件单独打开输出文件及调度线程的开销远大于复制本身)
+    def build(self, opt_path: str, max_workers: int | None = None) -> None:
         header_data = self.headerPrepare()
         offset_list_last_end = []
         offset_list_start = []
@@ -229,73 +318,72 @@ class AWBBuilder:
         offset_start = self.offsetAlignmentProcess(offset)
         offset_list_start.append(offset_start)
 
-        ## 每写入完整的一段数据，就会在其后填充`00`字节至数据对齐偏移量的整数倍
+        ## 根据各子文件的大小预先计算所有子文件的位置，写入时沿用此处取得的大小
+        subfiles_size = [os.stat(subfile).st_size for subfile in self.sunfiles]
+        for sf_size in subfiles_size:
+            offset = offset_start + sf_size
+            offset_start = self.offsetAlignmentProcess(offset)
+            offset_list_last_end.append(offset)
+            offset_list_start.append(offset_start)
+
+        ## 偏移量表已可确定，直接将其写入文件头数据中
+        offset_type_fc = _AWB_TYPECODES.get(self.offset_size)
+        if offset_type_fc is None:
+            raise ValueError(f"unsupported offset size: {self.offset_size}")
+        
+        if self.offset_mode == 0:
+            offset_list = offset_list_last_end
+        elif self.offset_mode == 1:
+            offset_list = offset_list_start
+        else:
+            raise ValueError(f"unsupported offset mode: {self.offset_mode}")
+        
+        struct.pack_into(f"<{self.subfiles_count + 1}{offset_type_fc}", header_data, 
+                         0x10 + self.audioid_size*self.subfiles_count, *offset_list)
+
+        ## 每写入完整的一段数据，其后都应填充`00`字节至数据对齐偏移量的整数倍
         ## 偏移量表生成模式决定了在最后一个子文件之后是否进行字节填充
+        ## 此处先将文件扩展至其最终大小，扩展部分由文件系统以`00`字节填充，因此不必再逐段写入填充字节
+        if (self.offset_mode == 1) or (self.subfiles_count == 0):
+            awb_file_size = offset_list_start[-1]
+        else:
+            awb_file_size = offset_list_last_end[-1]
+        parallel = (max_workers is not None) or \
+                   ((self.subfiles_count > 0) and (sum(subfiles_size) // self.subfiles_count >= _PARALLEL_COPY_MIN_SIZE))
         with open(opt_path, "wb") as file:
             file.write(header_data)
-            file.write(bytes(offset_start - offset))
-
-            subfile_number = 1
-            for subfile in self.sunfiles:
-                with open(subfile, "rb") as sf:
-                    sf.seek(0, 2)
-                    sf_size = sf.tell()
-                    sf.seek(0)
-                    file.write(sf.read(sf_size))
-                    offset = offset_start + sf_size
-                    offset_start = self.offsetAlignmentProcess(offset)
-                    offset_list_last_end.append(offset)
-                    offset_list_start.append(offset_start)
-                    if (subfile_number < self.subfiles_count) or (self.offset_mode == 1):
-                        file.write(bytes(offset_start - offset))
-                subfile_number += 1
-
-            ## 写入偏移量表
-            file.seek(0x10 + self.audioid_size*self.subfiles_count)
-            if self.offset_size == 0x02:
-                offset_type_fc = "<H"
-            elif self.offset_size == 0x04:
-                offset_type_fc = "<I"
-            else:
-                raise ValueError(f"unsupported offset size: {self.offset_size}")
-            
-            if self.offset_mode == 0:
-                offset_list = offset_list_last_end
-            elif self.offset_mode == 1:
-                offset_list = offset_list_start
-            else:
-                raise ValueError(f"unsupported offset mode: {self.offset_mode}")
-            
-            for idx in range(0, self.subfiles_count + 1):
-                file.write(struct.pack(offset_type_fc, offset_list[idx]))
-                
+            file.truncate(awb_file_size)
+            if not parallel:
+                for idx in range(0, self.subfiles_count):
+                    file.seek(offset_list_start[idx])
+                    self.subfileWrite(file, self.sunfiles[idx], subfiles_size[idx])
+
+        ## 各子文件的写入互相独立，以线程池并行执行
+        if parallel:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                tasks = [executor.submit(self.subfileCopy, opt_path, self.sunfiles[idx], offset_list_start[idx], subfiles_size[idx]) 
+                         for idx in range(0, self.subfiles_count)]
+                for task in tasks:
+                    task.result()
 
 
     ## 生成文件头数据，写入文件头部标识(4字节)、版本号(1字节)、偏移量表中每个条目的字节大小(1字节)、
     ## ID表中每个条目的字节大小(2字节)、包含文件数量(4字节)、数据对齐偏移量(2字节)、EHCA解密用的subkey(2字节)
     ## 计算ID表和偏移量表大小，以`00`字节填充
-    def headerPrepare(self) -> bytes:
-        header_data = bytearray()
-        header_data += b"AFS2"
-        header_data += struct.pack("<B", self.version)
-        header_data += struct.pack("<B", self.offset_size)
-        header_data += struct.pack("<H", self.audioid_size)
-        header_data += struct.pack("<I", self.subfiles_count)
-        header_data += struct.pack("<H", self.offset_alignment)
-        header_data += struct.pack("<H", self.subkey)
-
-        if self.audioid_size == 0x02:
-            audioid_type_fc = "<H"
-        elif self.audioid_size == 0x04:
-            audioid_type_fc = "<I"
-        else:
+    ## 按总大小一次性分配缓冲区，各项数据直接写入其中，偏移量表区域保持为`00`字节
+    def headerPrepare(self) -> bytearray:
+        header_size = 0x10 + self.audioid_size*self.subfiles_count + self.offset_size*(self.subfiles_count+1)
+        header_data = bytearray(header_size)
+        _AWB_HEADER.pack_into(header_data, 0x00, b"AFS2", self.version, self.offset_size, self.audioid_size, 
+                              self.subfiles_count, self.offset_alignment, self.subkey)
+
+        audioid_type_fc = _AWB_TYPECODES.get(self.audioid_size)
+        if audioid_type_fc is None:
             raise ValueError(f"unsupported audio ID size: {self.audioid_size}")
         
-        for idx in range(0, self.subfiles_count):
-            header_data += struct.pack(audioid_type_fc, idx)
-
-        header_data += bytes(self.offset_size * (self.subfiles_count+1))
+        ## 子文件ID为其序号，整张ID表一次性打包
+        struct.pack_into(f"<{self.subfiles_count}{audioid_type_fc}", header_data, 0x10, *range(0, self.subfiles_count))
 
-        return bytes(header_data)
+        return header_data
 
 
@@ -1,11 +1,15 @@
+import os
 import struct
-import re
+import mmap
 import json
-import base64
-import copy
-from io import BytesIO, FileIO
+import binascii
+import hashlib
+from array import array
 from enum import Enum, unique
-from collections.abc import Buffer
+from collections import Counter
+from dataclasses import dataclass, replace
+from typing import Any
+from collections.abc import Buffer, Callable, Iterator, Sequence
 
 ## UTF表所包含的数据类型
 ## 这部分数据来自vgmstream
@@ -30,32 +34,202 @@ class UTFTableValueType(Enum):
     COLUMN_TYPE_UINT128         = 0x0c # for GUIDs
     COLUMN_TYPE_UNDEFINED       = -1
 
+## 各数据类型在模式数据区域及行数据区域中的存储结构，大端序
+## 注意，其中两种类型为变长类型，其在模式数据区域及行数据区域中仅存储起始偏移量等信息
+## 『COLUMN_TYPE_STRING』为字符串，其数据本身存储于字符串数据区域，
+## 模式数据区域及行数据区域中存储其相对于字符串数据区域开头的偏移量(4字节)
+## 『COLUMN_TYPE_VLDATA』为二进制数据，其数据本身存储于字节数据区域，
+## 模式数据区域及行数据区域中存储其相对于字节数据区域开头的偏移量(4字节)、数据长度(4字节)
+_TYPE_STRUCTS = {
+    UTFTableValueType.COLUMN_TYPE_UINT8:    struct.Struct(">B"),
+    UTFTableValueType.COLUMN_TYPE_SINT8:    struct.Struct(">b"),
+    UTFTableValueType.COLUMN_TYPE_UINT16:   struct.Struct(">H"),
+    UTFTableValueType.COLUMN_TYPE_SINT16:   struct.Struct(">h"),
+    UTFTableValueType.COLUMN_TYPE_UINT32:   struct.Struct(">I"),
+    UTFTableValueType.COLUMN_TYPE_SINT32:   struct.Struct(">i"),
+    UTFTableValueType.COLUMN_TYPE_UINT64:   struct.Struct(">Q"),
+    UTFTableValueType.COLUMN_TYPE_SINT64:   struct.Struct(">q"),
+    UTFTableValueType.COLUMN_TYPE_FLOAT:    struct.Struct(">f"),
+    UTFTableValueType.COLUMN_TYPE_DOUBLE:   struct.Struct(">d"),
+    UTFTableValueType.COLUMN_TYPE_STRING:   struct.Struct(">I"),
+    UTFTableValueType.COLUMN_TYPE_VLDATA:   struct.Struct(">II"),
+}
+
+## 文件头部结构，大端序，各字段见UTFTable.headerRead
+_UTF_HEADER = struct.Struct(">4sIHHIIIHHI")
+
+## 模式数据区域中每列开头的结构，大端序，为数据信息(1字节)及列名偏移量(4字节)
+_UTF_SCHEMA_ENTRY = struct.Struct(">BI")
+
+## 数据类型名称与数据类型的对应关系，构建时以此查找json中的数据类型名称
+_TYPE_NAMES = dict(UTFTableValueType.__members__)
+
+## 受支持的类型标志与数据类型的对应关系，解析时以此代替逐个构造枚举值
+_TYPE_FLAGS = {value_type.value: value_type for value_type in _TYPE_STRUCTS}
+
+## 数值类型的行数据以数组(array)存储，此为各数值类型对应的数组类型码
+_TYPE_ARRAY_TYPECODES = {
+    UTFTableValueType.COLUMN_TYPE_UINT8:    "B",
+    UTFTableValueType.COLUMN_TYPE_SINT8:    "b",
+    UTFTableValueType.COLUMN_TYPE_UINT16:   "H",
+    UTFTableValueType.COLUMN_TYPE_SINT16:   "h",
+    UTFTableValueType.COLUMN_TYPE_UINT32:   "I",
+    UTFTableValueType.COLUMN_TYPE_SINT32:   "i",
+    UTFTableValueType.COLUMN_TYPE_UINT64:   "Q",
+    UTFTableValueType.COLUMN_TYPE_SINT64:   "q",
+    UTFTableValueType.COLUMN_TYPE_FLOAT:    "f",
+    UTFTableValueType.COLUMN_TYPE_DOUBLE:   "d",
+}
+
+## 预先分配的`00`字节串，对齐填充时从中切片取用，超出其长度时才另行生成
+_ZEROS = bytes(256)
+
+## 输入为文件路径时，文件大小达到此值才以内存映射方式打开，较小的文件直接读入内存
+_MMAP_MIN_SIZE = 1 << 24
+
+## UTF表中的一列
+## 含数据标志、数据类型及列名，以及常量数据或行数据(视数据标志而定，未包含的数据为None)
+@dataclass(slots=True)
+class UTFTableColumn:
+    data_flag:              int
+    value_type:             UTFTableValueType
+    column_name:            str | None = None
+    column_data_constant:   Any = None
+    column_data_rows:       Any = None
+
+    ## 将此列整理为字典，字典格式与json输出一致(未经base64编码等处理)
+    def toDict(self) -> dict:
+        column_dict = {"dataFlag":self.data_flag, "valueType":self.value_type.name}
+        if self.data_flag in (0x01, 0x03, 0x05):
+            column_dict["columnName"] = self.column_name
+        if self.data_flag == 0x03:
+            column_dict["columnDataConstant"] = self.column_data_constant
+        elif self.data_flag == 0x05:
+            column_dict["columnDataRows"] = self.column_data_rows
+        return column_dict
+
+## UTF表的字符串数据区域
+## 保存字符串数据区域的副本，字符串的查找及解码均基于此进行(memoryview不支持查找及解码)
+## 同一偏移量的字符串仅解码一次，之后直接从缓存中获取
+## 独立于UTFTable，以免字符串类型的行数据引用整个UTF表
+class UTFTableStrings:
+    __slots__ = ("pool", "encoding", "cache")
+
+    def __init__(self, pool: bytes, encoding: str) -> None:
+        self.pool = pool
+        self.encoding = encoding
+        ## 已读取的字符串，以其相对于字符串数据区域开头的偏移量为键
+        self.cache = {}
+
+    ## 获取字符串，入参为其相对于字符串数据区域开头的偏移量
+    def get(self, offset: int) -> str:
+        string = self.cache.get(offset)
+        if string is not None:
+            return string
+        if offset >= len(self.pool):
+            raise ValueError(f"strings offset out of bounds: {offset:#x}")
+        ## 以字符串结尾的`00`字节确定字符串范围
+        end = self.pool.find(b"\x00", offset)
+        if end < 0:
+            raise ValueError(f"unterminated string at strings offset: {offset:#x}")
+        string = self.pool[offset:end].decode(self.encoding)
+        self.cache[offset] = string
+
+        return string
+
+## 字符串类型的行数据
+## 仅保存各行字符串相对于字符串数据区域开头的偏移量，按索引访问或遍历时才从字符串数据区域读取字符串
+## 切片时返回已读取字符串的列表
+class UTFTableStringRows(Sequence):
+    __slots__ = ("offsets", "string_get")
+
+    def __init__(self, offsets: array, string_get: Callable[[int], str]) -> None:
+        self.offsets = offsets
+        self.string_get = string_get
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, idx: int | slice) -> str | list[str]:
+        if isinstance(idx, slice):
+            return [self.string_get(offset) for offset in self.offsets[idx]]
+        return self.string_get(self.offsets[idx])
+
+    def __iter__(self) -> Iterator[str]:
+        return map(self.string_get, self.offsets)
+
 class UTFTable:
     ## UTF表是CRI定义的一种数据结构，可嵌套
     ## 文件头部大小为0x20字节，其后依次为模式数据区域、行数据区域、字符串数据区域、字节数据区域
+    ## 输入为字节串或memoryview时，二进制数据(COLUMN_TYPE_VLDATA)以引用UTF表内存的memoryview给出，不作复制
+    ## 输入为文件路径时，二进制数据复制为字节串，不保留对文件映射的引用，
+    ## 以免外部保留的二进制数据(如getDataValue的返回值、以此表构建的UTFTableBuilder中的数据)在文件被改写或映射关闭后失效
+    ## 较大的文件以内存映射方式打开，映射在close或实例被回收前一直保持打开状态(Windows下此时无法写入该文件)，
+    ## 需要改写同一文件时，请先调用close，或以with语句使用UTFTable实例
 
     def __init__(self, stream: str | Buffer, encoding: str="utf8") -> None:
-        if type(stream) == str:
-            self.stream = FileIO(stream)
-            self.filename = re.split(r"[/\\]", stream)[-1]
-        else:
-            self.stream = BytesIO(stream)
+        ## 输入为文件路径时，若文件较大，则以只读方式映射整个文件，按需从系统缓存中读取，不必将整个文件复制到内存中
+        ## 否则直接将整个文件读入内存，不保留对文件的占用
+        ## 输入为memoryview时(如内嵌于另一张UTF表中的UTF表)，直接基于其引用的内存进行解析，不作复制
+        ## 其余情况将整个UTF表一次性读入内存，其后的解析均直接基于内存中的数据进行
+        if isinstance(stream, str):
+            with open(stream, "rb") as file:
+                if os.fstat(file.fileno()).st_size >= _MMAP_MIN_SIZE:
+                    self.buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self.buf = file.read()
+            self.filename = os.path.basename(stream.replace("\\", "/"))
+        elif isinstance(stream, memoryview):
+            self.buf = stream
             self.filename = ""
+        elif isinstance(stream, Buffer):
+            self.buf = bytes(stream)
+            self.filename = ""
+        else:
+            raise TypeError(f"invalid stream type: {type(stream)}")
+        ## 二进制数据均以此memoryview切片获取，不作复制
+        self._view = memoryview(self.buf)
         self.headerRead()
         self.headerCheck()
         self.encoding = encoding
+        ## 字符串数据区域，字符串的读取及缓存均由其处理
+        self._strings = UTFTableStrings(bytes(self._view[self.strings_offset:self.data_offset]), encoding)
         self.table_name = self.stringDataGet(self.name_offset_rtst)
         self.parsed = False
 
+    ## 关闭文件的内存映射，输入为文件路径时可用于及时释放映射
+    ## 关闭前先读取尚未读取的字符串行数据，以免关闭后无法获取(二进制数据已为字节串，无需处理)
+    ## 若仍有其它对象引用映射内存，则无法关闭，抛出BufferError，此时UTF表仍可正常使用
+    def close(self) -> None:
+        if isinstance(self.buf, mmap.mmap):
+            if self.parsed:
+                for column in self.columns:
+                    if isinstance(column.column_data_rows, UTFTableStringRows):
+                        column.column_data_rows = list(column.column_data_rows)
+            self._view.release()
+            try:
+                self.buf.close()
+            except BufferError:
+                ## 映射未能关闭，重新创建memoryview以恢复可用状态
+                self._view = memoryview(self.buf)
+                raise
+
+    def __enter__(self) -> "UTFTable":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
     def headerRead(self) -> None:
         ## 文件头读取，大端序，含头部标识(4字节)、UTF表大小(4字节)、版本号(2字节)、
         ## 行数据区域偏移量(2字节)、字符串数据区域偏移量(4字节)、字节数据区域偏移量(4字节)、
         ## 表格名称相对于字符串数据区域头部的偏移量(4字节)、列数(2字节)、行宽(2字节)、行数(4字节)
         ## 表格名称偏移量是相对于字符串数据区域头部的
         ## 其它偏移量则默认以UTF表开头为基准点(注意其它偏移量及UTF表大小读取后需+8)
-        stream = self.stream
-        stream.seek(0)
-        self.headerID = stream.read(4)
+        if len(self.buf) < _UTF_HEADER.size:
+            raise ValueError("invalid utf table header")
+        (self.headerID, table_size, self.version, rows_offset, strings_offset, data_offset, 
+         self.name_offset_rtst, self.columns_count, self.row_width, self.rows_count) = _UTF_HEADER.unpack_from(self.buf, 0)
 
         if self.headerID == b"@UTF":
             #self.encrypted = False
@@ -67,15 +241,10 @@ class UTFTable:
         else:
             raise ValueError("invalid utf table header")
         
-        self.table_size = struct.unpack(">I", stream.read(4))[0] + 0x08
-        self.version = struct.unpack(">H", stream.read(2))[0]
-        self.rows_offset = struct.unpack(">H", stream.read(2))[0] + 0x08
-        self.strings_offset = struct.unpack(">I", stream.read(4))[0] + 0x08
-        self.data_offset = struct.unpack(">I", stream.read(4))[0] + 0x08
-        self.name_offset_rtst = struct.unpack(">I", stream.read(4))[0]
-        self.columns_count = struct.unpack(">H", stream.read(2))[0]
-        self.row_width = struct.unpack(">H", stream.read(2))[0]
-        self.rows_count = struct.unpack(">I", stream.read(4))[0]
+        self.table_size = table_size + 0x08
+        self.rows_offset = rows_offset + 0x08
+        self.strings_offset = strings_offset + 0x08
+        self.data_offset = data_offset + 0x08
 
     ## 根据文件头数据计算各区域大小，并检查其是否合法
     def headerCheck(self) -> None:
@@ -97,7 +266,12 @@ class UTFTable:
             raise ValueError(f"invalid data size: {self.data_size}")
 
     def utfParse(self) -> None:
-        stream = self.stream
+        ## 循环中反复使用的属性及方法预先绑定为局部变量
+        buf = self.buf
+        string_get = self._strings.get
+        binary_get = self.binaryDataGet
+        rows_start = self.rows_offset
+        rows_end = self.rows_offset + self.rows_count*self.row_width
         data_columns = []
 
         ## 模式数据区域解析，依次遍历各列的模式数据
@@ -107,16 +281,14 @@ class UTFTable:
         offset = 0x20
         offset_in_row = 0
         for _ in range(0, self.columns_count):
-            if offset + 5 - 0x20 > self.schema_size:
-                raise ValueError(f"schema offset out of bounds: {offset + 5 - 0x20:#x}")
-            stream.seek(offset)
-            info        = struct.unpack(">B", stream.read(1))[0]
-            name_offset = struct.unpack(">I", stream.read(4))[0]
-            offset += 5
+            if offset + _UTF_SCHEMA_ENTRY.size - 0x20 > self.schema_size:
+                raise ValueError(f"schema offset out of bounds: {offset + _UTF_SCHEMA_ENTRY.size - 0x20:#x}")
+            info, name_offset = _UTF_SCHEMA_ENTRY.unpack_from(buf, offset)
+            offset += _UTF_SCHEMA_ENTRY.size
 
             data_flag = info >> 4
             type_flag = info & 0x0F
-            value_type = UTFTableValueType(type_flag)
+            value_type = _TYPE_FLAGS.get(type_flag)
 
             ## 处理数据标志，数据标志共4位
             ## 0x10位为列名，0x20位为常量数据，0x40为行数据，0x80位未知
@@ -137,70 +309,31 @@ class UTFTable:
             else:
                 raise ValueError(f"unsupported data flag: {data_flag}")
             
-            ## 处理类型标志
-            if value_type == UTFTableValueType.COLUMN_TYPE_UINT8:
-                value_size = 1
-                value_type_fc = ">B"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_SINT8:
-                value_size = 1
-                value_type_fc = ">b"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_UINT16:
-                value_size = 2
-                value_type_fc = ">H"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_SINT16:
-                value_size = 2
-                value_type_fc = ">h"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_UINT32:
-                value_size = 4
-                value_type_fc = ">I"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_SINT32:
-                value_size = 4
-                value_type_fc = ">i"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_UINT64:
-                value_size = 8
-                value_type_fc = ">Q"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_SINT64:
-                value_size = 8
-                value_type_fc = ">q"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_FLOAT:
-                value_size = 4
-                value_type_fc = ">f"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_DOUBLE:
-                value_size = 8
-                value_type_fc = ">d"
-            ## 注意，以下两种类型为变长类型，其在模式数据区域及行数据区域中仅存储起始偏移量等信息
-            ## 『COLUMN_TYPE_STRING』为字符串，其数据本身存储于字符串数据区域，
-            ## 模式数据区域及行数据区域中存储其相对于字符串数据区域开头的偏移量(4字节)
-            ## 『COLUMN_TYPE_VLDATA』为二进制数据，其数据本身存储于字节数据区域，
-            ## 模式数据区域及行数据区域中存储其相对于字节数据区域开头的偏移量(4字节)、数据长度(4字节)
-            elif value_type == UTFTableValueType.COLUMN_TYPE_STRING:
-                value_size = 4
-                value_type_fc = ">I"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_VLDATA:
-                value_size = 8
-                value_type_fc = ">II"
-            else:
-                raise ValueError(f"unsupported value type: {value_type.name}")
+            ## 处理类型标志，获取该类型对应的数据结构
+            if value_type is None:
+                raise ValueError(f"unsupported value type: {type_flag:#x}")
+            value_struct = _TYPE_STRUCTS[value_type]
+            value_size = value_struct.size
             
             ## 获取列名
+            column = UTFTableColumn(data_flag, value_type)
             if data_flag_name:
-                column_name = self.stringDataGet(name_offset)
+                column.column_name = string_get(name_offset)
 
             ## 读取常量数据
             if data_flag_constant:
                 if offset + value_size - 0x20 > self.schema_size:
                     raise ValueError(f"schema offset out of bounds: {offset + value_size - 0x20:#x}")
-                stream.seek(offset)
-                column_value = struct.unpack(value_type_fc, stream.read(value_size))
+                column_value = value_struct.unpack_from(buf, offset)
                 offset += value_size
 
                 ## 处理字符串以及二进制数据
                 if value_type == UTFTableValueType.COLUMN_TYPE_STRING:
-                    column_data_constant = self.stringDataGet(column_value[0])
+                    column.column_data_constant = string_get(column_value[0])
                 elif value_type == UTFTableValueType.COLUMN_TYPE_VLDATA:
-                    column_data_constant = self.binaryDataGet(column_value[0], column_value[1])
+                    column.column_data_constant = binary_get(column_value[0], column_value[1])
                 else:
-                    column_data_constant = column_value[0]
+                    column.column_data_constant = column_value[0]
 
             ## 获取行数据偏移量并逐行读取数据
             if data_flag_row:
@@ -209,71 +342,75 @@ class UTFTable:
                 column_offset_in_row = offset_in_row
                 offset_in_row += value_size
 
-                column_data_rows = []
+                ## 各行为定长结构，以列偏移量及行宽构建仅包含该列的行结构(其余部分以填充字节跳过)
+                ## 整列数据以一次iter_unpack读取，不再逐行计算偏移量并读取
+                column_row_struct = struct.Struct(f">{column_offset_in_row}x{value_struct.format[1:]}{self.row_width - offset_in_row}x")
+                rows_view = memoryview(buf)[rows_start:rows_end]
+                column_row_values = list(column_row_struct.iter_unpack(rows_view))
+                rows_view.release()
+
+                ## 各行的值以元组解包取出，不再逐行索引
                 if value_type == UTFTableValueType.COLUMN_TYPE_STRING:
-                    for row_idx in range(0, self.rows_count):
-                        stream.seek(self.rows_offset + row_idx*self.row_width + column_offset_in_row)
-                        column_row_value = struct.unpack(value_type_fc, stream.read(value_size))
-                        column_data_rows.append(self.stringDataGet(column_row_value[0]))
+                    ## 字符串在使用时才读取，此处仅检查偏移量是否越界
+                    string_offsets = array("I", [string_offset for string_offset, in column_row_values])
+                    if string_offsets and (max(string_offsets) >= self.strings_size):
+                        raise ValueError(f"strings offset out of bounds: {max(string_offsets):#x}")
+                    column.column_data_rows = UTFTableStringRows(string_offsets, string_get)
                 elif value_type == UTFTableValueType.COLUMN_TYPE_VLDATA:
-                    for row_idx in range(0, self.rows_count):
-                        stream.seek(self.rows_offset + row_idx*self.row_width + column_offset_in_row)
-                        column_row_value = struct.unpack(value_type_fc, stream.read(value_size))
-                        column_data_rows.append(self.binaryDataGet(column_row_value[0], column_row_value[1]))
+                    column.column_data_rows = [binary_get(bytes_offset, bytes_size) for bytes_offset, bytes_size in column_row_values]
                 else:
-                    for row_idx in range(0, self.rows_count):
-                        stream.seek(self.rows_offset + row_idx*self.row_width + column_offset_in_row)
-                        column_row_value = struct.unpack(value_type_fc, stream.read(value_size))
-                        column_data_rows.append(column_row_value[0])
-
-            ## 将此列的数据整理为字典
-            column_data = {"dataFlag":data_flag, "valueType":value_type.name}
-
-            if data_flag_name:
-                column_data["columnName"] = column_name
-
-            if data_flag_constant:
-                column_data["columnDataConstant"] = column_data_constant
-
-            if data_flag_row:
-                column_data["columnDataRows"] = column_data_rows.copy()
+                    ## 数值类型的行数据以数组(array)存储，不必为每个数值单独创建Python对象
+                    column.column_data_rows = array(_TYPE_ARRAY_TYPECODES[value_type], 
+                                                    [column_row_value for column_row_value, in column_row_values])
             
-            data_columns.append(column_data.copy())
+            data_columns.append(column)
 
         self.columns = data_columns
+        ## 列名-列索引字典在首次按列名获取数据时建立，重新解析后需重建
+        self.columns_names_dict = None
         self.parsed = True
             
-    ## 将UTF表的数据整理为用于json输出的字典
-    def utf2DictJson(self) -> dict:
+    ## 整理UTF表的表格名称、版本号、行数、列数，作为用于json输出的字典的开头部分
+    def headDictJson(self) -> dict:
         if not self.parsed:
             self.utfParse()
 
         if len(self.columns) != self.columns_count:
             raise ValueError(f"expected columns count {self.columns_count}, actual columns count {len(self.columns)}")
         
-        data = {"tableName":self.table_name, "version":self.version, 
+        return {"tableName":self.table_name, "version":self.version, 
                 "rowsCount":self.rows_count, "columnsCount":self.columns_count}
-        
-        data_columns = []
+
+    ## 将UTF表的数据整理为用于json输出的字典
+    def utf2DictJson(self) -> dict:
+        data = self.headDictJson()
+        data["columns"] = list(self.columnsDictJson())
+
+        return data
+
+    ## 逐列将UTF表的数据整理为用于json输出的字典
+    def columnsDictJson(self) -> Iterator[dict]:
         for column in self.columns:
-            data_column = column.copy()
+            data_column = column.toDict()
             ## 将二进制数据编码为base64字符串
             if data_column["valueType"] == "COLUMN_TYPE_VLDATA":
                 if data_column["dataFlag"] == 0x03:
-                    data_column["columnDataConstant"] = base64.b64encode(data_column["columnDataConstant"]).decode(self.encoding)
+                    data_column["columnDataConstant"] = self.base64Encode(data_column["columnDataConstant"])
                 elif data_column["dataFlag"] == 0x05:
                     ## 生成新的列表存储行数据以避免影响原值
-                    data_column_rows = [base64.b64encode(row).decode(self.encoding) for row in data_column["columnDataRows"]]
+                    data_column_rows = [self.base64Encode(row) for row in data_column["columnDataRows"]]
                     data_column["columnDataRows"] = data_column_rows
                 elif data_column["dataFlag"] == 0x01:
                     pass
                 else:
                     raise ValueError(f"unsupported data flag: {data_column["dataFlag"]}")
-            data_columns.append(data_column)
-
-        data["columns"] = data_columns
-
-        return data
+            ## 数值类型的行数据以数组(array)存储，输出时转换为列表
+            elif isinstance(data_column.get("columnDataRows"), array):
+                data_column["columnDataRows"] = data_column["columnDataRows"].tolist()
+            ## 字符串类型的行数据在此读取为列表
+            elif isinstance(data_column.get("columnDataRows"), UTFTableStringRows):
+                data_column["columnDataRows"] = list(data_column["columnDataRows"])
+            yield data_column
                     
     ## 将UTF表的数据递归地整理为用于json输出的字典
     ## UTF表可能以二进制数据的形式存储于另一张UTF表里，此处尝试将嵌套的所有UTF表整理为字典
@@ -283,87 +420,95 @@ class UTFTable:
         if depth > depth_max:
             raise ValueError(f"current depth({depth}) exceeds the maximum depth({depth_max})")
         
-        if not self.parsed:
-            self.utfParse()
+        data = self.headDictJson()
+        data["columns"] = list(self.columnsDictJsonRecursion(depth_max, depth))
 
-        if len(self.columns) != self.columns_count:
-            raise ValueError(f"expected columns count {self.columns_count}, actual columns count {len(self.columns)}")
-        
-        data = {"tableName":self.table_name, "version":self.version, 
-                "rowsCount":self.rows_count, "columnsCount":self.columns_count}
-        
-        data_columns = []
+        return data
+
+    ## 逐列将UTF表的数据递归地整理为用于json输出的字典，参数同utf2DictJsonRecursion
+    def columnsDictJsonRecursion(self, depth_max: int=5, depth: int=0) -> Iterator[dict]:
         for column in self.columns:
-            data_column = column.copy()
+            data_column = column.toDict()
             ## 将二进制数据编码为base64字符串
             if data_column["valueType"] == "COLUMN_TYPE_VLDATA":
                 if data_column["dataFlag"] == 0x03:
                     data_raw = data_column["columnDataConstant"]
                     if (data_raw[:4] == b"@UTF") and (depth < depth_max):
                         data_column["valueType"] = "COLUMN_TYPE_VLDATA_UTFTABLE"
+                        ## 内嵌UTF表的字典为新建的字典，直接使用即可
                         utf_table = UTFTable(data_raw)
-                        utf_table_dict = utf_table.utf2DictJsonRecursion(depth_max, depth+1)
-                        data_column["columnDataConstant"] = utf_table_dict.copy()
+                        data_column["columnDataConstant"] = utf_table.utf2DictJsonRecursion(depth_max, depth+1)
                     else:
-                        data_column["columnDataConstant"] = base64.b64encode(data_raw).decode(self.encoding)
+                        data_column["columnDataConstant"] = self.base64Encode(data_raw)
                 elif data_column["dataFlag"] == 0x05:
                     ## 生成新的列表存储行数据以避免影响原值
                     ## 此处默认某列中的所有二进制数据都是UTF表(或者都不是)
                     data_raw = data_column["columnDataRows"][0]
                     if (data_raw[:4] == b"@UTF") and (depth < depth_max):
                         data_column["valueType"] = "COLUMN_TYPE_VLDATA_UTFTABLE"
-                        data_column_rows = []
-                        for row in data_column["columnDataRows"]:
-                            utf_table = UTFTable(row)
-                            utf_table_dict = utf_table.utf2DictJsonRecursion(depth_max, depth+1)
-                            data_column_rows.append(utf_table_dict.copy())
+                        data_column_rows = [UTFTable(row).utf2DictJsonRecursion(depth_max, depth+1) 
+                                            for row in data_column["columnDataRows"]]
                         data_column["columnDataRows"] = data_column_rows
                     else:
-                        data_column_rows = [base64.b64encode(row).decode(self.encoding) for row in data_column["columnDataRows"]]
+                        data_column_rows = [self.base64Encode(row) for row in data_column["columnDataRows"]]
                         data_column["columnDataRows"] = data_column_rows
                 elif data_column["dataFlag"] == 0x01:
                     pass
                 else:
                     raise ValueError(f"unsupported data flag: {data_column["dataFlag"]}")
-            data_columns.append(data_column)
-
-        data["columns"] = data_columns
-
-        return data
+            ## 数值类型的行数据以数组(array)存储，输出时转换为列表
+            elif isinstance(data_column.get("columnDataRows"), array):
+                data_column["columnDataRows"] = data_column["columnDataRows"].tolist()
+            ## 字符串类型的行数据在此读取为列表
+            elif isinstance(data_column.get("columnDataRows"), UTFTableStringRows):
+                data_column["columnDataRows"] = list(data_column["columnDataRows"])
+            yield data_column
+
+    ## 将开头部分及逐列整理所得的字典依次编码为json文本片段
+    ## 拼接结果与对完整的字典进行json.dump的结果一致，但无需在内存中同时保留所有列的字典
+    ## 各列以iterencode分段编码(同json.dump)，不将整列的json文本拼接为单个字符串
+    def jsonIterEncode(self, data_head: dict, data_columns: Iterator[dict]) -> Iterator[str]:
+        encoder = json.JSONEncoder(ensure_ascii=False)
+        yield json.dumps(data_head, ensure_ascii=False)[:-1] + ", \"columns\": ["
+        for idx, data_column in enumerate(data_columns):
+            if idx > 0:
+                yield ", "
+            yield from encoder.iterencode(data_column)
+        yield "]}"
         
-    ## 将UTF表的数据输出为json
+    ## 将UTF表的数据输出为json，逐列整理并写入文件
     def jsonOutput(self, opt_path: str) -> None:
+        data_head = self.headDictJson()
         with open(opt_path, "w", encoding=self.encoding) as file:
-            json.dump(self.utf2DictJson(), file, ensure_ascii=False)
+            file.writelines(self.jsonIterEncode(data_head, self.columnsDictJson()))
 
     def jsonOutputRecursion(self, opt_path: str) -> None:
+        data_head = self.headDictJson()
         with open(opt_path, "w", encoding=self.encoding) as file:
-            json.dump(self.utf2DictJsonRecursion(), file, ensure_ascii=False)
+            file.writelines(self.jsonIterEncode(data_head, self.columnsDictJsonRecursion()))
 
 
     ## 从字符串数据区域获取字符串，入参为其相对于字符串数据区域开头的偏移量
     def stringDataGet(self, offset: int) -> str:
-        if offset >= self.strings_size:
-            raise ValueError(f"strings offset out of bounds: {offset:#x}")
-        stream = self.stream
-        stream.seek(self.strings_offset + offset)
-        strbytes = bytearray()
-        strbyte = stream.read(1)
-        while strbyte != b"\x00":
-            strbytes += strbyte
-            strbyte = stream.read(1)
-        string = strbytes.decode(self.encoding)
-
-        return string
+        return self._strings.get(offset)
     
     ## 从字节数据区域获取二进制数据，入参为其相对于字节数据区域开头的偏移量及数据大小
-    def binaryDataGet(self, offset: int, size: int) -> bytes:
+    ## 输入为字节串或memoryview时，返回引用UTF表内存的memoryview，不作复制
+    ## 输入为文件路径时，从文件映射中复制为字节串返回，不向外部暴露对映射内存的引用
+    def binaryDataGet(self, offset: int, size: int) -> bytes | memoryview:
         if offset + size > self.data_size:
             raise ValueError(f"binary data offset out of bounds: {offset + size:#x}")
-        stream = self.stream
-        stream.seek(self.data_offset + offset)
+        start = self.data_offset + offset
+
+        if isinstance(self.buf, mmap.mmap):
+            return self.buf[start:start + size]
+        return self._view[start:start + size]
 
-        return stream.read(size)
+    ## 将二进制数据编码为base64字符串
+    ## 直接调用binascii编码，所得字节串仅含ASCII字符，直接以ascii解码为字符串
+    ## 不缓存编码结果：二进制数据每次获取均为新的memoryview，缓存无法命中，反而使编码结果常驻内存
+    def base64Encode(self, data: Buffer) -> str:
+        return binascii.b2a_base64(data, newline=False).decode("ascii")
 
     ## 输出文件头数据，调试用
     def headerDataOutput(self, opt_path: str) -> None:
@@ -380,22 +525,24 @@ class UTFTable:
 
     ## 检查各列名称是否重复，并返回列名-列索引字典
     def checkColumnsName(self) -> dict[str, int]:
-        columns_name = {}
-        for idx in range(0, self.columns_count):
-            column = self.columns[idx]
-            if column["columnName"] not in columns_name:
-                columns_name[column["columnName"]] = idx
-            ## "Non"表示无效列???
-            elif column["columnName"] == "Non":
-                pass
-            else:
-                raise ValueError(f"duplicate column name: {column["columnName"]}")
+        columns_name_list = [column.column_name for column in self.columns[:self.columns_count]]
+        columns_name_count = Counter(columns_name_list)
+        ## "Non"表示无效列???可以重复，重复时取首个
+        for column_name, count in columns_name_count.items():
+            if (count > 1) and (column_name != "Non"):
+                raise ValueError(f"duplicate column name: {column_name}")
+
+        columns_name = {column_name: idx for idx, column_name in enumerate(columns_name_list) if column_name != "Non"}
+        if "Non" in columns_name_count:
+            columns_name["Non"] = columns_name_list.index("Non")
             
         return columns_name
     
     ## 根据列名及行索引获取数据
     def getDataValue(self, column_name: str, row_idx: int):
-        if "columns_names_dict" not in self.__dict__:
+        if not self.parsed:
+            self.utfParse()
+        if self.columns_names_dict is None:
             self.columns_names_dict = self.checkColumnsName()
 
         if column_name not in self.columns_names_dict:
@@ -405,14 +552,14 @@ class UTFTable:
             raise ValueError(f"invalid row index: {row_idx}")
         
         column = self.columns[self.columns_names_dict[column_name]]
-        if column["dataFlag"] == 0x01:
+        if column.data_flag == 0x01:
             return None
-        elif column["dataFlag"] == 0x03:
-            return column["columnDataConstant"]
-        elif column["dataFlag"] == 0x05:
-            return column["columnDataRows"][row_idx]
+        elif column.data_flag == 0x03:
+            return column.column_data_constant
+        elif column.data_flag == 0x05:
+            return column.column_data_rows[row_idx]
         else:
-            raise ValueError(f"unsupported data flag: {column["dataFlag"]}")
+            raise ValueError(f"unsupported data flag: {column.data_flag}")
 
 
 
@@ -426,11 +573,20 @@ class UTFTableBuilder:
     ## encoding为构建UTF表时处理字符串所使用的编码，打开json文件时也会使用之
     ## offset_alignment为数据对齐偏移量，用于向字节数据区域写入数据时的对齐
     ## (aic的acb文件一般是以0x20为数据对齐偏移量进行对齐的，但实际上未经对齐处理的acb文件也能被正常读取)
-    def __init__(self, data_raw: UTFTable | dict | str, encoding: str="utf8", offset_alignment: int | None = None) -> None:
+    ## cache_inner_tables为是否缓存已构建的内嵌UTF表，内容相同的内嵌UTF表(如重复的配置行)仅构建一次
+    ## 缓存需对每个内嵌UTF表数据字典计算摘要，内嵌UTF表多不重复时反而更慢，故默认不启用
+    ## 内嵌UTF表始终在当前线程中逐个递归构建；不启用缓存时，内容相同的内嵌UTF表也会各自重新构建，
+    ## 含大量重复内嵌UTF表(如acb中重复的配置行)时，请传入cache_inner_tables=True
+    def __init__(self, data_raw: UTFTable | dict | str, encoding: str="utf8", offset_alignment: int | None = None, 
+                 cache_inner_tables: bool=False) -> None:
         self.from_UTFTable = False
         self.encoding = encoding
         self.offset_alignment = offset_alignment
-        if type(data_raw) == UTFTable:
+        self.cache_inner_tables = cache_inner_tables
+        ## 已构建的内嵌UTF表，以其数据字典json文本的摘要为键，在各层内嵌UTF表的构建间共用
+        ## 仅在一次构建期间有效，构建结束后即清空
+        self.inner_tables_cache = {} if cache_inner_tables else None
+        if isinstance(data_raw, UTFTable):
             self.from_UTFTable = True
             if not data_raw.parsed:
                 data_raw.utfParse()
@@ -438,18 +594,33 @@ class UTFTableBuilder:
             self.version = data_raw.version
             self.rows_count = data_raw.rows_count
             self.columns_count = data_raw.columns_count
-            self.columns = copy.deepcopy(data_raw.columns)
-        elif type(data_raw) == dict:
+            ## 列中的数值、字符串及字节串均不可变，可直接共用；仅复制各列及其行数据容器，以免修改时影响原UTF表
+            self.columns = [replace(column, column_data_rows=column.column_data_rows[:]) if column.column_data_rows is not None else replace(column) 
+                            for column in data_raw.columns]
+        elif isinstance(data_raw, dict):
             self.data_raw_dict = data_raw
-        elif type(data_raw) == str:
+            ## 传入的字典由外部持有，提取数据时需复制其中的行数据列表
+            self.rows_copy = True
+        elif isinstance(data_raw, str):
             with open(data_raw, "r", encoding=encoding) as file:
                 self.data_raw_dict = json.load(file)
+            ## 从json文件读取的字典仅由此实例持有，提取数据时可直接使用其中的行数据列表
+            self.rows_copy = False
         else:
             raise ValueError(f"invalid data_raw type: {type(data_raw)}")
         
     ## UTF表构建
-    ## 当以包含内嵌UTF表数据字典的字典为基础构建UTF表时，此方法会被递归地调用
+    ## 启用内嵌UTF表缓存时，缓存在构建结束后清空，不在实例上保留已构建的数据
     def build(self) -> bytes:
+        if not self.cache_inner_tables:
+            return self.tableBuild()
+        try:
+            return self.tableBuild()
+        finally:
+            self.inner_tables_cache.clear()
+
+    ## 当以包含内嵌UTF表数据字典的字典为基础构建UTF表时，此方法会被递归地调用
+    def tableBuild(self) -> bytes:
         if not self.from_UTFTable:
             self.dataDictExtract()
 
@@ -462,15 +633,14 @@ class UTFTableBuilder:
             raise ValueError(f"expected columns count {self.columns_count}, actual columns count {len(self.columns)}")
             
         ## 建立UTF表的头部区域、模式数据区域、行数据区域、字符串数据区域、字节数据区域
-        header_data     = bytearray()
-        schema_data     = bytearray()
-        rows_data       = bytearray()
+        ## 头部区域及模式数据区域大小可预先确定，预先分配后以pack_into按偏移量写入
+        ## 其余区域为bytearray，写入数据时原地追加，避免每次拼接都复制整个区域
+        header_data     = bytearray(_UTF_HEADER.size)
+        schema_data     = bytearray(self.schemaSizeGet())
+        rows_data       = b""
         strings_data    = bytearray()
         binary_data     = bytearray()
-
-        ## 字符串数据区域偏移量字典，用于记录已有的字符串及其偏移量
-        ## 当需要写入的字符串与已有的字符串相同时，则将已有字符串的偏移量写入对应数据区域，以避免存储重复的字符串
-        strings_offset_dict = {}
+        schema_pos      = 0
 
         ## 根据行数建立各行数据
         rows_data_list = []
@@ -479,17 +649,24 @@ class UTFTableBuilder:
             
         ## 写入表格名称
         table_name_offset = len(strings_data)
-        strings_data = strings_data + self.table_name.encode(self.encoding) + b"\x00"
+        strings_data += self.table_name.encode(self.encoding) + b"\x00"
+
+        ## 字符串数据区域偏移量字典，用于记录已有的字符串及其偏移量
+        ## 预先按写入顺序收集所有列名及字符串数据，去重后依次编码写入字符串数据区域
+        ## 当需要写入的字符串与已有的字符串相同时，则将已有字符串的偏移量写入对应数据区域，以避免存储重复的字符串
+        strings_offset_dict = dict.fromkeys(self.stringsCollect())
+        for string in strings_offset_dict:
+            strings_offset_dict[string] = len(strings_data)
+            strings_data += string.encode(self.encoding) + b"\x00"
 
         ## 遍历各列，将数据写入对应的区域
         for column in self.columns:
-            data_flag = column["dataFlag"]
-            value_type = UTFTableValueType[column["valueType"]]
+            data_flag = column.data_flag
+            value_type = column.value_type
             type_flag = value_type.value
 
-            ## 写入数据信息字节
+            ## 数据信息字节
             info = (data_flag << 4) + type_flag
-            schema_data = schema_data + struct.pack(">B", info)
 
             ## 处理数据标志，同UTFTable类
             data_flag_name = False
@@ -507,99 +684,47 @@ class UTFTableBuilder:
                 raise ValueError(f"unsupported data flag: {data_flag}")
             
             ## 处理类型标志，同UTFTable类
-            if value_type == UTFTableValueType.COLUMN_TYPE_UINT8:
-                value_type_fc = ">B"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_SINT8:
-                value_type_fc = ">b"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_UINT16:
-                value_type_fc = ">H"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_SINT16:
-                value_type_fc = ">h"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_UINT32:
-                value_type_fc = ">I"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_SINT32:
-                value_type_fc = ">i"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_UINT64:
-                value_type_fc = ">Q"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_SINT64:
-                value_type_fc = ">q"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_FLOAT:
-                value_type_fc = ">f"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_DOUBLE:
-                value_type_fc = ">d"
-            ## 注意，以下两种类型为变长类型，其在模式数据区域及行数据区域中仅存储起始偏移量等信息
-            ## 『COLUMN_TYPE_STRING』为字符串，其数据本身存储于字符串数据区域，
-            ## 模式数据区域及行数据区域中存储其相对于字符串数据区域开头的偏移量(4字节)
-            ## 『COLUMN_TYPE_VLDATA』为二进制数据，其数据本身存储于字节数据区域，
-            ## 模式数据区域及行数据区域中存储其相对于字节数据区域开头的偏移量(4字节)、数据长度(4字节)
-            elif value_type == UTFTableValueType.COLUMN_TYPE_STRING:
-                value_type_fc = ">I"
-            elif value_type == UTFTableValueType.COLUMN_TYPE_VLDATA:
-                value_type_fc = ">II"
-            else:
+            value_struct = _TYPE_STRUCTS.get(value_type)
+            if value_struct is None:
                 raise ValueError(f"unsupported value type: {value_type.name}")
 
-            ## 写入列名数据
+            ## 写入数据信息字节及列名数据
             if data_flag_name:
-                column_name = column["columnName"]
-                if column_name in strings_offset_dict:
-                    column_name_offset = strings_offset_dict[column_name]
-                else:
-                    column_name_offset = len(strings_data)
-                    strings_data = strings_data + column_name.encode(self.encoding) + b"\x00"
-                    strings_offset_dict[column_name] = column_name_offset
-                schema_data = schema_data + struct.pack(">I", column_name_offset)
+                column_name_offset = strings_offset_dict[column.column_name]
+                _UTF_SCHEMA_ENTRY.pack_into(schema_data, schema_pos, info, column_name_offset)
+                schema_pos += _UTF_SCHEMA_ENTRY.size
 
             ## 写入常量数据
             if data_flag_constant:
                 if value_type == UTFTableValueType.COLUMN_TYPE_STRING:
-                    string = column["columnDataConstant"]
-                    if string in strings_offset_dict:
-                        string_offset = strings_offset_dict[string]
-                    else:
-                        string_offset = len(strings_data)
-                        strings_data = strings_data + string.encode(self.encoding) + b"\x00"
-                        strings_offset_dict[string] = string_offset
-                    schema_data = schema_data + struct.pack(value_type_fc, string_offset)
+                    string_offset = strings_offset_dict[column.column_data_constant]
+                    value_struct.pack_into(schema_data, schema_pos, string_offset)
                 elif value_type == UTFTableValueType.COLUMN_TYPE_VLDATA:
-                    bytes_raw = column["columnDataConstant"]
-                    if self.offset_alignment is not None:
-                        bytes_raw = self.bytearrayAlignmentProcess(bytes_raw)
-                    bytes_offset = len(binary_data)
-                    bytes_size = len(bytes_raw)
-                    binary_data = binary_data + bytes_raw
-                    schema_data = schema_data + struct.pack(value_type_fc, bytes_offset, bytes_size)
+                    bytes_offset, bytes_size = self.binaryDataAppend(binary_data, column.column_data_constant)
+                    value_struct.pack_into(schema_data, schema_pos, bytes_offset, bytes_size)
                 else:
-                    schema_data = schema_data + struct.pack(value_type_fc, column["columnDataConstant"])
+                    value_struct.pack_into(schema_data, schema_pos, column.column_data_constant)
+                schema_pos += value_struct.size
 
             ## 写入行数据
             if data_flag_row:
                 ## 检查行数据列表长度与预期行数是否一致
-                rows = column["columnDataRows"]
+                rows = column.column_data_rows
                 if len(rows) != self.rows_count:
                     raise ValueError(f"expected rows count {self.rows_count}, actual rows count {len(rows)}")
+                ## 各行共用该列数据类型对应的已编译结构，循环前取出其pack方法
+                ## 行数据为bytearray，`+=`原地追加，故可直接与行数据列表逐一对应
+                pack = value_struct.pack
                 if value_type == UTFTableValueType.COLUMN_TYPE_STRING:
-                    for idx in range(0, self.rows_count):
-                        string = rows[idx]
-                        if string in strings_offset_dict:
-                            string_offset = strings_offset_dict[string]
-                        else:
-                            string_offset = len(strings_data)
-                            strings_data = strings_data + string.encode(self.encoding) + b"\x00"
-                            strings_offset_dict[string] = string_offset
-                        rows_data_list[idx] = rows_data_list[idx] + struct.pack(value_type_fc, string_offset)
+                    for row_data, string in zip(rows_data_list, rows):
+                        row_data += pack(strings_offset_dict[string])
                 elif value_type == UTFTableValueType.COLUMN_TYPE_VLDATA:
-                    for idx in range(0, self.rows_count):
-                        bytes_raw = rows[idx]
-                        if self.offset_alignment is not None:
-                            bytes_raw = self.bytearrayAlignmentProcess(bytes_raw)
-                        bytes_offset = len(binary_data)
-                        bytes_size = len(bytes_raw)
-                        binary_data = binary_data + bytes_raw
-                        rows_data_list[idx] = rows_data_list[idx] + struct.pack(value_type_fc, bytes_offset, bytes_size)
+                    binary_data_append = self.binaryDataAppend
+                    for row_data, bytes_raw in zip(rows_data_list, rows):
+                        row_data += pack(*binary_data_append(binary_data, bytes_raw))
                 else:
-                    for idx in range(0, self.rows_count):
-                        rows_data_list[idx] = rows_data_list[idx] + struct.pack(value_type_fc, rows[idx])
+                    for row_data, value in zip(rows_data_list, rows):
+                        row_data += pack(value)
 
         ## 检查各行长度是否一致
         row_width = 0
@@ -608,8 +733,7 @@ class UTFTableBuilder:
             if any((len(row) != row_width) for row in rows_data_list):
                 raise ValueError(f"lengths of each rows are not entirely consistent")
             ## 将各行数据写入行数据区域
-            for row in rows_data_list:
-                rows_data = rows_data + row
+            rows_data = b"".join(rows_data_list)
             
         ## 计算各区域大小及其偏移量
         schema_size         = len(schema_data)
@@ -626,26 +750,27 @@ class UTFTableBuilder:
         if self.offset_alignment is not None:
             remainder = binary_data_offset % self.offset_alignment
             if remainder > 0:
-                strings_data = strings_data + bytearray(self.offset_alignment - remainder)
+                padding_size = self.offset_alignment - remainder
+                strings_data += _ZEROS[:padding_size] if padding_size <= len(_ZEROS) else bytes(padding_size)
                 strings_size        = len(strings_data)
                 binary_data_offset  = strings_offset + strings_size
                 table_size          = binary_data_offset + binary_data_size
 
         ## 写入文件头部数据
-        header_data += b"@UTF"
-        header_data += struct.pack(">I", table_size - 0x08)
-        header_data += struct.pack(">H", self.version)
-        header_data += struct.pack(">H", rows_offset - 0x08)
-        header_data += struct.pack(">I", strings_offset - 0x08)
-        header_data += struct.pack(">I", binary_data_offset - 0x08)
-        header_data += struct.pack(">I", table_name_offset)
-        header_data += struct.pack(">H", self.columns_count)
-        header_data += struct.pack(">H", row_width)
-        header_data += struct.pack(">I", self.rows_count)
+        _UTF_HEADER.pack_into(header_data, 0, 
+                              b"@UTF", 
+                              table_size - 0x08, 
+                              self.version, 
+                              rows_offset - 0x08, 
+                              strings_offset - 0x08, 
+                              binary_data_offset - 0x08, 
+                              table_name_offset, 
+                              self.columns_count, 
+                              row_width, 
+                              self.rows_count)
 
         ## 拼接各区域数据并输出
-        data_result = header_data + schema_data + rows_data + strings_data + binary_data
-        return bytes(data_result)
+        return b"".join((header_data, schema_data, rows_data, strings_data, binary_data))
 
     ## 从UTF表数据字典中提取数据
     ## 当UTF表数据字典中含有内嵌的UTF表数据字典时，此方法会被递归地调用
@@ -657,67 +782,150 @@ class UTFTableBuilder:
 
         data_columns = []
         for column_raw in self.data_raw_dict["columns"]:
-            column_data = {}
-            column_data["dataFlag"] = column_raw["dataFlag"]
-            column_data["valueType"] = column_raw["valueType"]
-
-            ## 读取各列数据，将其中以base64字符串存储的二进制数据还原为字节串
-            ## 若所存储的数据为内嵌的UTF表数据字典，则将其构建为原始的二进制形式的UTF表
-            if column_raw["dataFlag"] == 0x01:
-                column_data["columnName"] = column_raw["columnName"]
-            ## 处理常量数据
-            elif column_raw["dataFlag"] == 0x03:
-                column_data["columnName"] = column_raw["columnName"]
-                if column_raw["valueType"] == "COLUMN_TYPE_VLDATA":
-                    column_data["columnDataConstant"] = base64.b64decode(column_raw["columnDataConstant"])
-                elif column_raw["valueType"] == "COLUMN_TYPE_VLDATA_UTFTABLE":
-                    utf_builder = UTFTableBuilder(column_raw["columnDataConstant"], self.encoding, self.offset_alignment)
-                    column_data["columnDataConstant"] = utf_builder.build()
-                    column_data["valueType"] = "COLUMN_TYPE_VLDATA"
-                elif column_raw["valueType"] in UTFTableValueType.__members__:
-                    column_data["columnDataConstant"] = column_raw["columnDataConstant"]
-                else:
-                    raise ValueError(f"unsupported value type: {column_raw["valueType"]}")
-            ## 处理行数据
-            ## 生成新的列表存储行数据以避免影响原值
-            elif column_raw["dataFlag"] == 0x05:
-                column_data["columnName"] = column_raw["columnName"]
-                if column_raw["valueType"] == "COLUMN_TYPE_VLDATA":
-                    column_data_rows = [base64.b64decode(row) for row in column_raw["columnDataRows"]]
-                    column_data["columnDataRows"] = column_data_rows
-                elif column_raw["valueType"] == "COLUMN_TYPE_VLDATA_UTFTABLE":
-                    column_data_rows = []
-                    for row in column_raw["columnDataRows"]:
-                        utf_builder = UTFTableBuilder(row, self.encoding, self.offset_alignment)
-                        column_data_rows.append(utf_builder.build())
-                    column_data["columnDataRows"] = column_data_rows
-                    column_data["valueType"] = "COLUMN_TYPE_VLDATA"
-                elif column_raw["valueType"] in UTFTableValueType.__members__:
-                    column_data["columnDataRows"] = column_raw["columnDataRows"].copy()
-                else:
-                    raise ValueError(f"unsupported value type: {column_raw["valueType"]}")
+            data_flag = column_raw["dataFlag"]
+            value_type_name = column_raw["valueType"]
+
+            ## 内嵌的UTF表数据字典构建为UTF表后，以二进制数据的形式存储
+            if value_type_name == "COLUMN_TYPE_VLDATA_UTFTABLE":
+                value_type = UTFTableValueType.COLUMN_TYPE_VLDATA
             else:
-                raise ValueError(f"unsupported data flag: {column_raw["dataFlag"]}")
+                value_type = _TYPE_NAMES.get(value_type_name)
+                if value_type is None:
+                    raise ValueError(f"unsupported value type: {value_type_name}")
+            column = UTFTableColumn(data_flag, value_type)
+
+            ## 按数据标志及数据类型名称查找对应的数据提取方法，普通数据类型使用数据类型名称为None的条目
+            extractor = self._DATA_EXTRACTORS.get((data_flag, value_type_name))
+            if extractor is None:
+                extractor = self._DATA_EXTRACTORS.get((data_flag, None))
+                if extractor is None:
+                    raise ValueError(f"unsupported data flag: {data_flag}")
+            column.column_name = column_raw["columnName"]
+            extractor(self, column, column_raw)
             
-            data_columns.append(column_data.copy())
+            data_columns.append(column)
 
         self.columns = data_columns
 
+    ## 各列数据的提取方法，入参为待写入数据的列及UTF表数据字典中该列的字典
+    ## 读取各列数据，将其中以base64字符串存储的二进制数据还原为字节串
+    ## 直接调用binascii解码，省去base64.b64decode在每次调用时对入参的额外处理
+    ## 若所存储的数据为内嵌的UTF表数据字典，则将其构建为原始的二进制形式的UTF表
+
+    ## 仅含列名的列，无需提取数据
+    def nameOnlyExtract(self, column: UTFTableColumn, column_raw: dict) -> None:
+        pass
+
+    ## 处理常量数据
+    def constantExtract(self, column: UTFTableColumn, column_raw: dict) -> None:
+        column.column_data_constant = column_raw["columnDataConstant"]
+
+    def constantVLDataExtract(self, column: UTFTableColumn, column_raw: dict) -> None:
+        column.column_data_constant = binascii.a2b_base64(column_raw["columnDataConstant"])
+
+    def constantUTFTableExtract(self, column: UTFTableColumn, column_raw: dict) -> None:
+        column.column_data_constant = self.innerTableBuild(column_raw["columnDataConstant"])
+
+    ## 处理行数据
+    ## 生成新的列表存储行数据以避免影响原值(原值仅由此实例持有时除外)
+    def rowsExtract(self, column: UTFTableColumn, column_raw: dict) -> None:
+        if self.rows_copy:
+            column.column_data_rows = column_raw["columnDataRows"].copy()
+        else:
+            column.column_data_rows = column_raw["columnDataRows"]
+
+    def rowsVLDataExtract(self, column: UTFTableColumn, column_raw: dict) -> None:
+        column.column_data_rows = [binascii.a2b_base64(row) for row in column_raw["columnDataRows"]]
+
+    def rowsUTFTableExtract(self, column: UTFTableColumn, column_raw: dict) -> None:
+        column.column_data_rows = [self.innerTableBuild(row) for row in column_raw["columnDataRows"]]
+
+    ## (数据标志, 数据类型名称)与数据提取方法的对应关系
+    _DATA_EXTRACTORS = {
+        (0x01, None):                               nameOnlyExtract,
+        (0x03, None):                               constantExtract,
+        (0x03, "COLUMN_TYPE_VLDATA"):               constantVLDataExtract,
+        (0x03, "COLUMN_TYPE_VLDATA_UTFTABLE"):      constantUTFTableExtract,
+        (0x05, None):                               rowsExtract,
+        (0x05, "COLUMN_TYPE_VLDATA"):               rowsVLDataExtract,
+        (0x05, "COLUMN_TYPE_VLDATA_UTFTABLE"):      rowsUTFTableExtract,
+    }
+
+    ## 将内嵌的UTF表数据字典构建为UTF表
+    ## 启用缓存时以数据字典json文本的摘要为键，不保留json文本本身
+    ## 数据字典无法转换为json文本时(含有json不支持的数据)，不使用缓存
+    def innerTableBuild(self, data_raw_dict: dict) -> bytes:
+        key = None
+        if self.inner_tables_cache is not None:
+            try:
+                key_text = json.dumps(data_raw_dict, sort_keys=True, separators=(",", ":"))
+            except (TypeError, ValueError):
+                pass
+            else:
+                key = hashlib.blake2b(key_text.encode("utf8")).digest()
+                del key_text
+                utf_table = self.inner_tables_cache.get(key)
+                if utf_table is not None:
+                    return utf_table
+
+        ## 内嵌UTF表共用外层的缓存，由最外层的构建负责清空
+        utf_builder = UTFTableBuilder(data_raw_dict, self.encoding, self.offset_alignment)
+        utf_builder.rows_copy = self.rows_copy
+        utf_builder.inner_tables_cache = self.inner_tables_cache
+        utf_table = utf_builder.tableBuild()
+        if key is not None:
+            self.inner_tables_cache[key] = utf_table
+
+        return utf_table
+
+    ## 计算模式数据区域大小
+    ## 每列为数据信息字节(1字节)、列名偏移量(4字节)，常量列另加常量数据
+    ## 不支持的数据标志及类型在此不作处理，写入时再报错
+    def schemaSizeGet(self) -> int:
+        schema_size = 0
+        for column in self.columns:
+            schema_size += _UTF_SCHEMA_ENTRY.size
+            if column.data_flag == 0x03:
+                value_struct = _TYPE_STRUCTS.get(column.value_type)
+                if value_struct is not None:
+                    schema_size += value_struct.size
+        return schema_size
+
+    ## 按写入顺序遍历各列的列名及字符串数据(可能重复)
+    def stringsCollect(self) -> Iterator[str]:
+        for column in self.columns:
+            if column.data_flag in (0x01, 0x03, 0x05):
+                yield column.column_name
+            if column.value_type == UTFTableValueType.COLUMN_TYPE_STRING:
+                if column.data_flag == 0x03:
+                    yield column.column_data_constant
+                elif column.data_flag == 0x05:
+                    yield from column.column_data_rows
+
     ## 构建UTF表并输出至指定文件
+    ## 先完成构建再打开输出文件，输出路径与数据来源为同一文件时，打开(截断)文件不会影响构建
     def buildFile(self, opt_path: str) -> None:
+        data = self.build()
         with open(opt_path, "wb") as file:
-            file.write(self.build())
+            file.write(data)
+
+    ## 向字节数据区域追加二进制数据，返回其相对于字节数据区域开头的偏移量及数据大小
+    ## 需要对齐时，直接在字节数据区域末尾原地填充`00`字节，不另行生成填充后的副本(数据大小包含填充部分)
+    def binaryDataAppend(self, binary_data: bytearray, bytes_raw: Buffer) -> tuple[int, int]:
+        bytes_offset = len(binary_data)
+        binary_data += bytes_raw
+        if self.offset_alignment is not None:
+            padding_size = -len(bytes_raw) % self.offset_alignment
+            if padding_size > 0:
+                binary_data += _ZEROS[:padding_size] if padding_size <= len(_ZEROS) else bytes(padding_size)
+
+        return bytes_offset, len(binary_data) - bytes_offset
 
     ## 数据对齐处理，若不足则于原数据后填充`00`字节
+    ## 以ljust一次完成填充，无需另行创建填充字节串再拼接
     def bytearrayAlignmentProcess(self, bytes_raw: Buffer) -> bytes:
-        bytes_result = bytearray()
         bytes_raw_size = len(bytes_raw)
-        remainder = bytes_raw_size % self.offset_alignment
-        if remainder > 0:
-            bytes_result = bytes_raw + bytearray(self.offset_alignment - remainder)
-        else:
-            ## remainder == 0
-            bytes_result = bytes_raw
-        return bytes(bytes_result)
+        bytes_aligned_size = (bytes_raw_size + self.offset_alignment - 1) // self.offset_alignment * self.offset_alignment
+        return bytes(bytes_raw).ljust(bytes_aligned_size, b"\x00")
 
 